@@ -4,34 +4,52 @@ from typing import Optional
 
 import ihm
 import modelcif
+import numpy as np
 from modelcif import Assembly, AsymUnit, Entity, System, dumper
 from modelcif.model import AbInitioModel, Atom, ModelGroup
-from rdkit import Chem
 from torch import Tensor
 
 from boltz.data import const
 from boltz.data.types import Structure
-from boltz.data.write.utils import generate_tags
+from boltz.data.write.utils import (
+    Template,
+    atom_elements,
+    atom_names,
+    generate_tags,
+    stream_template,
+)
 
+# Placeholder for a single atom coordinate
+COORD_PLACEHOLDER = "@COORD@"
 
-def to_mmcif(structure: Structure, plddts: Optional[Tensor] = None) -> str:  # noqa: C901, PLR0915, PLR0912
-    """Write a structure into an MMCIF file.
+
+def to_mmcif_template(  # noqa: C901, PLR0915, PLR0912
+    structure: Structure,
+    plddts: Optional[Tensor] = None,
+) -> Template:
+    """Write a structure into an MMCIF template.
+
+    The atom coordinates are left as placeholders, so the
+    template can be filled with any set of coordinates.
 
     Parameters
     ----------
     structure : Structure
         The input structure
+    plddts : Tensor, optional
+        The per token pLDDT scores
 
     Returns
     -------
-    str
-        the output MMCIF file
+    Template
+        the output MMCIF template
 
     """
     system = System()
 
-    # Load periodic table for element mapping
-    periodic_table = Chem.GetPeriodicTable()
+    # Decode all atom names and elements at once
+    names = atom_names(structure.atoms)
+    elements = atom_elements(structure.atoms)
 
     # Map entities to chain_ids
     entity_to_chains = {}
@@ -111,6 +129,44 @@ def to_mmcif(structure: Structure, plddts: Optional[Tensor] = None) -> str:  # n
         asym_unit_map[chain_idx] = asym
     modeled_assembly = Assembly(asym_unit_map.values(), name="Modeled assembly")
 
+    # Collect all atom sites, in the order they are written
+    atom_idx = []
+    atom_sites = []
+    for chain in structure.chains:
+        het = chain["mol_type"] == const.chain_type_ids["NONPOLYMER"]
+        chain_idx = chain["asym_id"]
+        res_start = chain["res_idx"]
+        res_end = chain["res_idx"] + chain["res_num"]
+
+        residues = structure.residues[res_start:res_end]
+        for residue in residues:
+            atom_start = residue["atom_idx"]
+            atom_end = residue["atom_idx"] + residue["atom_num"]
+            atoms = structure.atoms[atom_start:atom_end]
+            for i, atom in enumerate(atoms):
+                # This should not happen on predictions, but just in case.
+                if not atom["is_present"]:
+                    continue
+
+                name = names[atom_start + i]
+                element = elements[atom_start + i]
+                residue_index = residue["res_idx"] + 1
+                atom_idx.append(atom_start + i)
+                atom_sites.append(
+                    Atom(
+                        asym_unit=asym_unit_map[chain_idx],
+                        type_symbol=element,
+                        seq_id=residue_index,
+                        atom_id=name,
+                        x=COORD_PLACEHOLDER,
+                        y=COORD_PLACEHOLDER,
+                        z=COORD_PLACEHOLDER,
+                        het=het,
+                        biso=1,
+                        occupancy=1,
+                    )
+                )
+
     class _LocalPLDDT(modelcif.qa_metric.Local, modelcif.qa_metric.PLDDT):
         name = "pLDDT"
         software = None
@@ -119,45 +175,7 @@ def to_mmcif(structure: Structure, plddts: Optional[Tensor] = None) -> str:  # n
     class _MyModel(AbInitioModel):
         def get_atoms(self) -> Iterator[Atom]:
             # Add all atom sites.
-            for chain in structure.chains:
-                # We rename the chains in alphabetical order
-                het = chain["mol_type"] == const.chain_type_ids["NONPOLYMER"]
-                chain_idx = chain["asym_id"]
-                res_start = chain["res_idx"]
-                res_end = chain["res_idx"] + chain["res_num"]
-
-                residues = structure.residues[res_start:res_end]
-                for residue in residues:
-                    atom_start = residue["atom_idx"]
-                    atom_end = residue["atom_idx"] + residue["atom_num"]
-                    atoms = structure.atoms[atom_start:atom_end]
-                    atom_coords = atoms["coords"]
-                    for i, atom in enumerate(atoms):
-                        # This should not happen on predictions, but just in case.
-                        if not atom["is_present"]:
-                            continue
-
-                        name = atom["name"]
-                        name = [chr(c + 32) for c in name if c != 0]
-                        name = "".join(name)
-                        element = periodic_table.GetElementSymbol(
-                            atom["element"].item()
-                        )
-                        element = element.upper()
-                        residue_index = residue["res_idx"] + 1
-                        pos = atom_coords[i]
-                        yield Atom(
-                            asym_unit=asym_unit_map[chain_idx],
-                            type_symbol=element,
-                            seq_id=residue_index,
-                            atom_id=name,
-                            x=f"{pos[0]:.5f}",
-                            y=f"{pos[1]:.5f}",
-                            z=f"{pos[2]:.5f}",
-                            het=het,
-                            biso=1,
-                            occupancy=1,
-                        )
+            yield from atom_sites
 
         def add_plddt(self, plddts):
             res_num = 0
@@ -187,4 +205,120 @@ def to_mmcif(structure: Structure, plddts: Optional[Tensor] = None) -> str:  # n
 
     fh = io.StringIO()
     dumper.write(fh, [system])
-    return fh.getvalue()
+    segments = fh.getvalue().split(COORD_PLACEHOLDER)
+    return Template(segments=segments, atom_idx=np.array(atom_idx, dtype=np.int64))
+
+
+def format_mmcif_coords(template: Template, coords: np.ndarray) -> list[str]:
+    """Format the coordinate values of each atom site.
+
+    Parameters
+    ----------
+    template : Template
+        The MMCIF template
+    coords : np.ndarray
+        The atom coordinates, for all atoms of the structure
+
+    Returns
+    -------
+    list[str]
+        The x, y and z values, for each written atom
+
+    """
+    return np.char.mod("%.5f", coords[template.atom_idx]).ravel().tolist()
+
+
+def fill_mmcif_template(template: Template, coords: np.ndarray) -> str:
+    """Fill an MMCIF template with atom coordinates.
+
+    Parameters
+    ----------
+    template : Template
+        The MMCIF template
+    coords : np.ndarray
+        The atom coordinates, for all atoms of the structure
+
+    Returns
+    -------
+    str
+        the output MMCIF file
+
+    """
+    return "".join(stream_mmcif_template(template, coords))
+
+
+def stream_mmcif_template(template: Template, coords: np.ndarray) -> Iterator[str]:
+    """Fill an MMCIF template with atom coordinates, chunk by chunk.
+
+    Parameters
+    ----------
+    template : Template
+        The MMCIF template
+    coords : np.ndarray
+        The atom coordinates, for all atoms of the structure
+
+    Yields
+    ------
+    str
+        the next chunk of the output MMCIF file
+
+    """
+    values = format_mmcif_coords(template, coords)
+    yield from stream_template(template.segments, values)
+
+
+def stream_mmcif_trajectory(template: Template, coords: np.ndarray) -> Iterator[str]:
+    """Fill an MMCIF template with several sets of coordinates, chunk by chunk.
+
+    Each set of coordinates is written as a separate data block,
+    named data_step_0, data_step_1, etc.
+
+    Parameters
+    ----------
+    template : Template
+        The MMCIF template
+    coords : np.ndarray
+        The atom coordinates, of shape (num_steps, num_atoms, 3)
+
+    Yields
+    ------
+    str
+        the next chunk of the output MMCIF file
+
+    """
+    # Drop the data block header, which is renamed for each step
+    segments = template.segments.copy()
+    segments[0] = segments[0].split("\n", 1)[1]
+
+    for step, step_coords in enumerate(coords):
+        yield f"data_step_{step}\n"
+        values = format_mmcif_coords(template, step_coords)
+        yield from stream_template(segments, values)
+
+
+def to_mmcif(
+    structure: Structure,
+    plddts: Optional[Tensor] = None,
+    coords: Optional[np.ndarray] = None,
+) -> str:
+    """Write a structure into an MMCIF file.
+
+    Parameters
+    ----------
+    structure : Structure
+        The input structure
+    plddts : Tensor, optional
+        The per token pLDDT scores
+    coords : np.ndarray, optional
+        The atom coordinates to write, by default those of the atom table
+
+    Returns
+    -------
+    str
+        the output MMCIF file
+
+    """
+    if coords is None:
+        coords = structure.atoms["coords"]
+    template = to_mmcif_template(structure, plddts)
+    return fill_mmcif_template(template, coords)
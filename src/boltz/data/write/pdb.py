@@ -1,12 +1,27 @@
-from rdkit import Chem
+from collections.abc import Iterator
+from typing import Optional
+
+import numpy as np
 
 from boltz.data import const
 from boltz.data.types import Structure
-from boltz.data.write.utils import generate_tags
+from boltz.data.write.utils import (
+    Template,
+    atom_elements,
+    atom_names,
+    generate_tags,
+    stream_template,
+)
 
+# Placeholder for the coordinate columns of an atom line
+COORDS_PLACEHOLDER = "@" * 24
 
-def to_pdb(structure: Structure) -> str:  # noqa: PLR0915
-    """Write a structure into a PDB file.
+
+def to_pdb_template(structure: Structure) -> Template:  # noqa: PLR0915
+    """Write a structure into a PDB template.
+
+    The atom coordinates are left as placeholders, so the
+    template can be filled with any set of coordinates.
 
     Parameters
     ----------
@@ -15,18 +30,20 @@ def to_pdb(structure: Structure) -> str:  # noqa: PLR0915
 
     Returns
     -------
-    str
-        the output PDB file
+    Template
+        the output PDB template
 
     """
     pdb_lines = []
+    atom_idx = []
 
     atom_index = 1
     atom_reindex_ter = []
     chain_tags = generate_tags()
 
-    # Load periodic table for element mapping
-    periodic_table = Chem.GetPeriodicTable()
+    # Decode all atom names and elements at once
+    names = atom_names(structure.atoms)
+    elements = atom_elements(structure.atoms)
 
     # Add all atom sites.
     for chain in structure.chains:
@@ -42,7 +59,6 @@ def to_pdb(structure: Structure) -> str:  # noqa: PLR0915
             atom_start = residue["atom_idx"]
             atom_end = residue["atom_idx"] + residue["atom_num"]
             atoms = structure.atoms[atom_start:atom_end]
-            atom_coords = atoms["coords"]
             for i, atom in enumerate(atoms):
                 # This should not happen on predictions, but just in case.
                 if not atom["is_present"]:
@@ -53,18 +69,14 @@ def to_pdb(structure: Structure) -> str:  # noqa: PLR0915
                     if chain["mol_type"] != const.chain_type_ids["NONPOLYMER"]
                     else "HETATM"
                 )
-                name = atom["name"]
-                name = [chr(c + 32) for c in name if c != 0]
-                name = "".join(name)
+                name = names[atom_start + i]
                 name = name if len(name) == 4 else f" {name}"  # noqa: PLR2004
                 alt_loc = ""
                 insertion_code = ""
                 occupancy = 1.00
-                element = periodic_table.GetElementSymbol(atom["element"].item())
-                element = element.upper()
+                element = elements[atom_start + i]
                 charge = ""
                 residue_index = residue["res_idx"] + 1
-                pos = atom_coords[i]
                 res_name_3 = (
                     "LIG" if record_type == "HETATM" else str(residue["name"][:3])
                 )
@@ -75,11 +87,12 @@ def to_pdb(structure: Structure) -> str:  # noqa: PLR0915
                     f"{record_type:<6}{atom_index:>5} {name:<4}{alt_loc:>1}"
                     f"{res_name_3:>3} {chain_tag:>1}"
                     f"{residue_index:>4}{insertion_code:>1}   "
-                    f"{pos[0]:>8.3f}{pos[1]:>8.3f}{pos[2]:>8.3f}"
+                    f"{COORDS_PLACEHOLDER}"
                     f"{occupancy:>6.2f}{b_factor:>6.2f}          "
                     f"{element:>2}{charge:>2}"
                 )
                 pdb_lines.append(atom_line)
+                atom_idx.append(atom_start + i)
                 atom_reindex_ter.append(atom_index)
                 atom_index += 1
 
@@ -96,6 +109,7 @@ def to_pdb(structure: Structure) -> str:  # noqa: PLR0915
             atom_index += 1
 
     # Dump CONECT records.
+    footer_lines = []
     for bonds in [structure.bonds, structure.connections]:
         for bond in bonds:
             atom1 = structure.atoms[bond["atom_1"]]
@@ -105,9 +119,123 @@ def to_pdb(structure: Structure) -> str:  # noqa: PLR0915
             atom1_idx = atom_reindex_ter[bond["atom_1"]]
             atom2_idx = atom_reindex_ter[bond["atom_2"]]
             conect_line = f"CONECT{atom1_idx:>5}{atom2_idx:>5}"
-            pdb_lines.append(conect_line)
+            footer_lines.append(conect_line)
+
+    footer_lines.append("END")
+    footer_lines.append("")
+    segments = "".join(f"{line:<80}\n" for line in pdb_lines)
+    segments = segments.split(COORDS_PLACEHOLDER)
+    footer = "\n".join(line.ljust(80) for line in footer_lines)
+    return Template(
+        segments=segments,
+        atom_idx=np.array(atom_idx, dtype=np.int64),
+        footer=footer,
+    )
+
+
+def format_pdb_coords(template: Template, coords: np.ndarray) -> list[str]:
+    """Format the coordinate columns of each atom line.
+
+    Parameters
+    ----------
+    template : Template
+        The PDB template
+    coords : np.ndarray
+        The atom coordinates, for all atoms of the structure
+
+    Returns
+    -------
+    list[str]
+        The coordinate columns, one per written atom
+
+    """
+    columns = np.char.mod("%8.3f", coords[template.atom_idx])
+    values = np.char.add(np.char.add(columns[:, 0], columns[:, 1]), columns[:, 2])
+    return values.tolist()
+
+
+def fill_pdb_template(template: Template, coords: np.ndarray) -> str:
+    """Fill a PDB template with atom coordinates.
+
+    Parameters
+    ----------
+    template : Template
+        The PDB template
+    coords : np.ndarray
+        The atom coordinates, for all atoms of the structure
+
+    Returns
+    -------
+    str
+        the output PDB file
+
+    """
+    return "".join(stream_pdb_template(template, coords))
+
+
+def stream_pdb_template(template: Template, coords: np.ndarray) -> Iterator[str]:
+    """Fill a PDB template with atom coordinates, chunk by chunk.
 
-    pdb_lines.append("END")
-    pdb_lines.append("")
-    pdb_lines = [line.ljust(80) for line in pdb_lines]
-    return "\n".join(pdb_lines)
+    Parameters
+    ----------
+    template : Template
+        The PDB template
+    coords : np.ndarray
+        The atom coordinates, for all atoms of the structure
+
+    Yields
+    ------
+    str
+        the next chunk of the output PDB file
+
+    """
+    yield from stream_template(template.segments, format_pdb_coords(template, coords))
+    yield template.footer
+
+
+def stream_pdb_trajectory(template: Template, coords: np.ndarray) -> Iterator[str]:
+    """Fill a PDB template with several sets of coordinates, chunk by chunk.
+
+    Each set of coordinates is written as a separate MODEL record.
+
+    Parameters
+    ----------
+    template : Template
+        The PDB template
+    coords : np.ndarray
+        The atom coordinates, of shape (num_models, num_atoms, 3)
+
+    Yields
+    ------
+    str
+        the next chunk of the output PDB file
+
+    """
+    for model_idx, model_coords in enumerate(coords):
+        yield f"{'MODEL':<6}    {model_idx + 1:>4}".ljust(80) + "\n"
+        values = format_pdb_coords(template, model_coords)
+        yield from stream_template(template.segments, values)
+        yield "ENDMDL".ljust(80) + "\n"
+    yield template.footer
+
+
+def to_pdb(structure: Structure, coords: Optional[np.ndarray] = None) -> str:
+    """Write a structure into a PDB file.
+
+    Parameters
+    ----------
+    structure : Structure
+        The input structure
+    coords : np.ndarray, optional
+        The atom coordinates to write, by default those of the atom table
+
+    Returns
+    -------
+    str
+        the output PDB file
+
+    """
+    if coords is None:
+        coords = structure.atoms["coords"]
+    template = to_pdb_template(structure)
+    return fill_pdb_template(template, coords)
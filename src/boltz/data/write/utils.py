@@ -1,5 +1,106 @@
 import string
 from collections.abc import Iterator
+from dataclasses import dataclass
+from functools import cache
+
+import numpy as np
+from rdkit import Chem
+
+
+@dataclass(frozen=True)
+class Template:
+    """A serialized structure with placeholder coordinates."""
+
+    segments: list[str]
+    atom_idx: np.ndarray
+    footer: str = ""
+
+
+def stream_template(
+    segments: list[str],
+    values: list[str],
+    chunk_size: int = 4096,
+) -> Iterator[str]:
+    """Fill the placeholders of a template, chunk by chunk.
+
+    This avoids building the filled text as one string, but the
+    template segments and the formatted values are still held in
+    memory, so the peak usage is about the size of the output file.
+
+    Parameters
+    ----------
+    segments : list[str]
+        The text segments around the placeholders
+    values : list[str]
+        The values to insert between the segments
+    chunk_size : int
+        The number of parts joined into each chunk
+
+    Yields
+    ------
+    str
+        The next chunk of the filled template
+
+    """
+    parts = [""] * (len(segments) + len(values))
+    parts[::2] = segments
+    parts[1::2] = values
+    for start in range(0, len(parts), chunk_size):
+        yield "".join(parts[start : start + chunk_size])
+
+
+@cache
+def element_table() -> np.ndarray:
+    """Get the upper case element symbol of each atomic number.
+
+    Returns
+    -------
+    np.ndarray
+        The element symbols, indexed by atomic number
+
+    """
+    periodic_table = Chem.GetPeriodicTable()
+    symbols = [
+        periodic_table.GetElementSymbol(i).upper()
+        for i in range(periodic_table.GetMaxAtomicNumber() + 1)
+    ]
+    return np.array(symbols)
+
+
+def atom_names(atoms: np.ndarray) -> list[str]:
+    """Decode the names of a table of atoms.
+
+    Parameters
+    ----------
+    atoms : np.ndarray
+        The atom table
+
+    Returns
+    -------
+    list[str]
+        The atom names
+
+    """
+    names = atoms["name"].astype(np.uint8)
+    names = np.where(names != 0, names + 32, 0).astype(np.uint8)
+    return np.char.decode(names.view("S4").ravel(), "ascii").tolist()
+
+
+def atom_elements(atoms: np.ndarray) -> list[str]:
+    """Get the element symbols of a table of atoms.
+
+    Parameters
+    ----------
+    atoms : np.ndarray
+        The atom table
+
+    Returns
+    -------
+    list[str]
+        The upper case element symbols
+
+    """
+    return element_table()[atoms["element"]].tolist()
 
 
 def generate_tags() -> Iterator[str]:
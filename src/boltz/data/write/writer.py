@@ -1,9 +1,11 @@
-from dataclasses import asdict, replace
-import json
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import replace
+import os
 from pathlib import Path
-from typing import Literal
+from typing import Any, Literal, Optional
 
 import numpy as np
+import orjson
 from pytorch_lightning import LightningModule, Trainer
 from pytorch_lightning.callbacks import BasePredictionWriter
 import torch
@@ -14,8 +16,209 @@ from boltz.data.types import (
     Record,
     Structure,
 )
-from boltz.data.write.mmcif import to_mmcif
-from boltz.data.write.pdb import to_pdb
+from boltz.data.write.mmcif import (
+    stream_mmcif_template,
+    stream_mmcif_trajectory,
+    to_mmcif_template,
+)
+from boltz.data.write.pdb import (
+    stream_pdb_template,
+    stream_pdb_trajectory,
+    to_pdb_template,
+)
+from boltz.data.write.utils import Template
+
+# Buffer size used when writing structure files
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Maximum number of background writer threads
+MAX_WRITE_WORKERS = 8
+
+# Scalar metrics written to the confidence summary
+CONFIDENCE_KEYS = [
+    "confidence_score",
+    "ptm",
+    "iptm",
+    "ligand_iptm",
+    "protein_iptm",
+    "complex_plddt",
+    "complex_iplddt",
+    "complex_pde",
+    "complex_ipde",
+]
+
+# Outputs consumed by the writer, moved to the CPU together
+OUTPUT_KEYS = [
+    "coords",
+    "masks",
+    "plddt",
+    "pae",
+    "pde",
+    *CONFIDENCE_KEYS,
+]
+
+
+def to_cpu(data: Any) -> Any:  # noqa: ANN401, the outputs are arbitrarily nested
+    """Move a nested collection of tensors to the CPU.
+
+    The copies are issued asynchronously, so the caller must
+    synchronize the source device before reading the results.
+
+    Parameters
+    ----------
+    data : Any
+        A tensor, or a nested dict / list / tuple of tensors.
+
+    Returns
+    -------
+    Any
+        The same collection, with all tensors on the CPU.
+
+    """
+    if isinstance(data, Tensor):
+        return data.to("cpu", non_blocking=True)
+    if isinstance(data, dict):
+        return {key: to_cpu(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return type(data)(to_cpu(value) for value in data)
+    return data
+
+
+def synchronize(device: torch.device) -> None:
+    """Wait for pending asynchronous copies from a device.
+
+    Parameters
+    ----------
+    device : torch.device
+        The device the copies were issued from.
+
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def write_structure(
+    path: Path,
+    structure: Structure,
+    output_format: str,
+    coords: np.ndarray,
+    plddts: Optional[Tensor] = None,
+    template: Optional[Template] = None,
+) -> None:
+    """Write a structure to disk in the requested format.
+
+    Parameters
+    ----------
+    path : Path
+        The output path.
+    structure : Structure
+        The structure to write.
+    output_format : str
+        The output format.
+    coords : np.ndarray
+        The atom coordinates to write.
+    plddts : Tensor, optional
+        The per token pLDDT scores, only used for mmCIF.
+    template : Template, optional
+        A template of the structure shared between models,
+        by default the structure is serialized for this call.
+
+    """
+    if output_format == "pdb":
+        if template is None:
+            template = to_pdb_template(structure)
+        chunks = stream_pdb_template(template, coords)
+    else:
+        if template is None:
+            template = to_mmcif_template(structure, plddts)
+        chunks = stream_mmcif_template(template, coords)
+
+    with path.open("w", buffering=WRITE_BUFFER_SIZE) as f:
+        f.writelines(chunks)
+
+
+def write_trajectory(
+    path: Path,
+    template: Template,
+    output_format: str,
+    coords: np.ndarray,
+) -> None:
+    """Write a sequence of coordinates for a structure to a single file.
+
+    The template is filled with each set of coordinates as a
+    separate model (PDB) or data block (mmCIF).
+
+    Parameters
+    ----------
+    path : Path
+        The output path.
+    template : Template
+        The template of the structure to write.
+    output_format : str
+        The output format.
+    coords : np.ndarray
+        The atom coordinates to write, of shape (num_steps, num_atoms, 3).
+
+    """
+    if output_format == "pdb":
+        chunks = stream_pdb_trajectory(template, coords)
+    else:
+        chunks = stream_mmcif_trajectory(template, coords)
+
+    with path.open("w", buffering=WRITE_BUFFER_SIZE) as f:
+        f.writelines(chunks)
+
+
+def write_model_outputs(
+    struct_dir: Path,
+    name: str,
+    *,
+    confidence: Optional[dict] = None,
+    plddt: Optional[np.ndarray] = None,
+    pae: Optional[np.ndarray] = None,
+    pde: Optional[np.ndarray] = None,
+) -> None:
+    """Write the small per model output files.
+
+    These are grouped so that each model needs a single
+    task on the writer pool, rather than one per file. The
+    plddt, pae and pde arrays are stored as float16.
+
+    Parameters
+    ----------
+    struct_dir : Path
+        The output directory.
+    name : str
+        The model name, used in each file name.
+    confidence : dict, optional
+        The confidence summary.
+    plddt : np.ndarray, optional
+        The pLDDT scores.
+    pae : np.ndarray, optional
+        The predicted aligned errors.
+    pde : np.ndarray, optional
+        The predicted distance errors.
+
+    """
+    if confidence is not None:
+        path = struct_dir / f"confidence_{name}.json"
+        path.write_bytes(
+            orjson.dumps(
+                confidence,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS,
+            )
+        )
+    if plddt is not None:
+        plddt = plddt.astype(np.float16)
+        np.savez(struct_dir / f"plddt_{name}.npz", plddt=plddt)
+    if pae is not None:
+        pae = pae.astype(np.float16)
+        np.savez(struct_dir / f"pae_{name}.npz", pae=pae)
+    if pde is not None:
+        pde = pde.astype(np.float16)
+        np.savez(struct_dir / f"pde_{name}.npz", pde=pde)
 
 
 class BoltzWriter(BasePredictionWriter):
@@ -45,6 +248,10 @@ class BoltzWriter(BasePredictionWriter):
         self.output_format = output_format
         self.failed = 0
 
+        # Serialization and file writes run in the background,
+        # on a pool that lives for a single predict epoch
+        self._pool: Optional[ThreadPoolExecutor] = None
+
         # Create the output directories
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -65,198 +272,184 @@ class BoltzWriter(BasePredictionWriter):
         # Get the records
         records: list[Record] = batch["record"]
 
-        # Get the predictions
-        coords = prediction["coords"]
+        # Start the writer threads on the first batch of the epoch
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=min(MAX_WRITE_WORKERS, os.cpu_count() or 1)
+            )
+
+        # Move all outputs to the CPU with a single synchronization
+        outputs = {key: prediction[key] for key in OUTPUT_KEYS if key in prediction}
+        outputs["intermediate_coords"] = prediction.get("intermediate_coords") or []
+
+        # Stack the pair chain ipTM into a single [C, C, M] tensor
+        if "pair_chains_iptm" in prediction:
+            chain_ids = list(prediction["pair_chains_iptm"])
+            outputs["pair_chains_iptm"] = torch.stack(
+                [
+                    torch.stack(
+                        [
+                            prediction["pair_chains_iptm"][idx1][idx2]
+                            for idx2 in chain_ids
+                        ]
+                    )
+                    for idx1 in chain_ids
+                ]
+            )
+
+        device = outputs["coords"].device
+        prediction = to_cpu(outputs)
+        synchronize(device)
+
+        # Get the predictions, with the final coordinates stacked after any
+        # intermediate steps, so that all of them are unpadded with one gather.
+        # The intermediate steps may already be on the CPU before the copy,
+        # so they are only stacked with the final coordinates on the host.
+        coords = torch.stack([*prediction["intermediate_coords"], prediction["coords"]])
         coords = coords.unsqueeze(0)
+        has_intermediates = coords.shape[1] > 1
         pad_masks = prediction["masks"]
+        plddt_all = prediction.get("plddt")
+        pae_all = prediction.get("pae")
+        pde_all = prediction.get("pde")
 
         # Get ranking
         argsort = torch.argsort(prediction["confidence_score"], descending=True)
-        idx_to_rank = {idx.item(): rank for rank, idx in enumerate(argsort)}
+        idx_to_rank = torch.empty_like(argsort)
+        idx_to_rank[argsort] = torch.arange(argsort.numel())
+        idx_to_rank = idx_to_rank.tolist()
+
+        # Get the confidence metrics as Python floats
+        confidence_metrics = {
+            key: prediction[key].tolist()
+            for key in CONFIDENCE_KEYS
+            if key in prediction
+        }
+        pair_chains_iptm = prediction.get("pair_chains_iptm")
+        if pair_chains_iptm is not None:
+            pair_chains_iptm = pair_chains_iptm.numpy()
 
         # Iterate over the records
+        futures = []
         for record, coord, pad_mask in zip(records, coords, pad_masks):
-            # Load the structure
+            # Load the structure, with masked chains removed
             path = self.data_dir / f"{record.id}.npz"
             structure: Structure = Structure.load(path)
-
-            # Compute chain map with masked removed
-            chain_map = {}
-            for i, mask in enumerate(structure.mask):
-                if mask:
-                    chain_map[len(chain_map)] = i
-
-            # Remove masked chains completely
             structure = structure.remove_invalid_chains()
 
-            for model_idx in range(coord.shape[0]):
-                # Save intermediate structures if available
-                if "intermediate_coords" in prediction:
-                    intermediate_dir = self.output_dir / record.id / "intermediate"
-                    intermediate_dir.mkdir(exist_ok=True, parents=True)
-                    
-                    for step, step_coords in enumerate(prediction["intermediate_coords"]):
-                        # Get coordinates for current model and step
-                        model_step_coords = step_coords[model_idx]
-                        # Unpad using the same mask
-                        coord_unpad = model_step_coords[pad_mask.bool()]
-                        coord_unpad = coord_unpad.cpu().numpy()
-                        
-                        # Create new structure with intermediate coordinates
-                        atoms = structure.atoms.copy()
-                        atoms["coords"] = coord_unpad
-                        atoms["is_present"] = True
-                        
-                        new_structure = replace(
-                            structure,
-                            atoms=atoms,
-                            residues=structure.residues,
-                            interfaces=np.array([], dtype=Interface)
-                        )
-                        
-                        # Save intermediate structure
-                        path = intermediate_dir / f"{record.id}_model_{idx_to_rank[model_idx]}_step_{step}.{self.output_format}"
-                        with path.open("w") as f:
-                            if self.output_format == "pdb":
-                                f.write(to_pdb(new_structure))
-                            elif self.output_format == "mmcif":
-                                f.write(to_mmcif(new_structure))
-                            else:
-                                np.savez_compressed(path, **asdict(new_structure))
+            # Mark all atoms and residues as present, once per record
+            structure.atoms["is_present"] = True
+            structure.residues["is_present"] = True
+            structure = replace(structure, interfaces=np.array([], dtype=Interface))
 
-                # Process final structure
-                model_coord = coord[model_idx]
-                coord_unpad = model_coord[pad_mask.bool()]
-                coord_unpad = coord_unpad.cpu().numpy()
-
-                # New atom table
-                atoms = structure.atoms
-                atoms["coords"] = coord_unpad
-                atoms["is_present"] = True
-
-                # Mew residue table
-                residues = structure.residues
-                residues["is_present"] = True
-
-                # Update the structure
-                interfaces = np.array([], dtype=Interface)
-                new_structure: Structure = replace(
-                    structure,
-                    atoms=atoms,
-                    residues=residues,
-                    interfaces=interfaces,
-                )
+            # Create the output directories, once per record
+            struct_dir = self.output_dir / record.id
+            intermediate_dir = struct_dir / "intermediate"
+            if has_intermediates:
+                intermediate_dir.mkdir(parents=True, exist_ok=True)
+            else:
+                struct_dir.mkdir(exist_ok=True)
 
-                # Update chain info
-                chain_info = []
-                for chain in new_structure.chains:
-                    old_chain_idx = chain_map[chain["asym_id"]]
-                    old_chain_info = record.chains[old_chain_idx]
-                    new_chain_info = replace(
-                        old_chain_info,
-                        chain_id=int(chain["asym_id"]),
-                        valid=True,
-                    )
-                    chain_info.append(new_chain_info)
+            # Serialize the structure once per record. Only the final mmCIF
+            # structures with pLDDT scores need a template for each model.
+            per_model_template = self.output_format == "mmcif" and plddt_all is not None
+            template = None
+            if self.output_format == "pdb":
+                template = to_pdb_template(structure)
+            elif has_intermediates or not per_model_template:
+                template = to_mmcif_template(structure)
+            final_template = None if per_model_template else template
 
-                # Save the structure
-                struct_dir = self.output_dir / record.id
-                struct_dir.mkdir(exist_ok=True)
+            # Unpad all coordinates with a single gather
+            atom_idx = pad_mask.bool().nonzero(as_tuple=True)[0]
+            coord_unpad_all = coord.index_select(2, atom_idx).numpy()
 
-                if self.output_format == "pdb":
+            extension = "pdb" if self.output_format == "pdb" else "cif"
+            for model_idx in range(coord.shape[1]):
+                # Save intermediate structures if available
+                if has_intermediates:
+                    # Save all intermediate steps of the model to one file
                     path = (
-                        struct_dir / f"{record.id}_model_{idx_to_rank[model_idx]}.pdb"
+                        intermediate_dir
+                        / f"{record.id}_model_{idx_to_rank[model_idx]}.{extension}"
                     )
-                    with path.open("w") as f:
-                        f.write(to_pdb(new_structure))
-                elif self.output_format == "mmcif":
-                    path = (
-                        struct_dir / f"{record.id}_model_{idx_to_rank[model_idx]}.cif"
+                    futures.append(
+                        self._pool.submit(
+                            write_trajectory,
+                            path,
+                            template,
+                            self.output_format,
+                            coord_unpad_all[:-1, model_idx],
+                        )
                     )
-                    with path.open("w") as f:
-                        if "plddt" in prediction:
-                            f.write(
-                                to_mmcif(new_structure, prediction["plddt"][model_idx])
-                            )
-                        else:
-                            f.write(to_mmcif(new_structure))
-                else:
-                    path = (
-                        struct_dir / f"{record.id}_model_{idx_to_rank[model_idx]}.npz"
+
+                # Process final structure
+                coord_unpad = coord_unpad_all[-1, model_idx]
+
+                # Save the structure
+                path = (
+                    struct_dir
+                    / f"{record.id}_model_{idx_to_rank[model_idx]}.{extension}"
+                )
+                plddts = plddt_all[model_idx] if plddt_all is not None else None
+                futures.append(
+                    self._pool.submit(
+                        write_structure,
+                        path,
+                        structure,
+                        self.output_format,
+                        coord_unpad,
+                        plddts,
+                        final_template,
                     )
-                    np.savez_compressed(path, **asdict(new_structure))
+                )
 
                 # Save confidence summary
-                if "plddt" in prediction:
-                    path = (
-                        struct_dir
-                        / f"confidence_{record.id}_model_{idx_to_rank[model_idx]}.json"
-                    )
-                    confidence_summary_dict = {}
-                    for key in [
-                        "confidence_score",
-                        "ptm",
-                        "iptm",
-                        "ligand_iptm",
-                        "protein_iptm",
-                        "complex_plddt",
-                        "complex_iplddt",
-                        "complex_pde",
-                        "complex_ipde",
-                    ]:
-                        confidence_summary_dict[key] = prediction[key][model_idx].item()
+                confidence_summary_dict = None
+                if plddt_all is not None:
+                    confidence_summary_dict = {
+                        key: metric[model_idx]
+                        for key, metric in confidence_metrics.items()
+                    }
+                    model_iptm = pair_chains_iptm[:, :, model_idx].tolist()
                     confidence_summary_dict["chains_ptm"] = {
-                        idx: prediction["pair_chains_iptm"][idx][idx][model_idx].item()
-                        for idx in prediction["pair_chains_iptm"]
+                        idx: model_iptm[i][i] for i, idx in enumerate(chain_ids)
                     }
                     confidence_summary_dict["pair_chains_iptm"] = {
                         idx1: {
-                            idx2: prediction["pair_chains_iptm"][idx1][idx2][
-                                model_idx
-                            ].item()
-                            for idx2 in prediction["pair_chains_iptm"][idx1]
+                            idx2: model_iptm[i][j] for j, idx2 in enumerate(chain_ids)
                         }
-                        for idx1 in prediction["pair_chains_iptm"]
+                        for i, idx1 in enumerate(chain_ids)
                     }
-                    with path.open("w") as f:
-                        f.write(
-                            json.dumps(
-                                confidence_summary_dict,
-                                indent=4,
-                            )
-                        )
 
-                    # Save plddt
-                    plddt = prediction["plddt"][model_idx]
-                    path = (
-                        struct_dir
-                        / f"plddt_{record.id}_model_{idx_to_rank[model_idx]}.npz"
-                    )
-                    np.savez_compressed(path, plddt=plddt.cpu().numpy())
-
-                # Save pae
-                if "pae" in prediction:
-                    pae = prediction["pae"][model_idx]
-                    path = (
-                        struct_dir
-                        / f"pae_{record.id}_model_{idx_to_rank[model_idx]}.npz"
+                # Save the confidence summary, plddt, pae and pde in one task
+                futures.append(
+                    self._pool.submit(
+                        write_model_outputs,
+                        struct_dir,
+                        f"{record.id}_model_{idx_to_rank[model_idx]}",
+                        confidence=confidence_summary_dict,
+                        plddt=plddts.numpy() if plddts is not None else None,
+                        pae=pae_all[model_idx].numpy() if pae_all is not None else None,
+                        pde=pde_all[model_idx].numpy() if pde_all is not None else None,
                     )
-                    np.savez_compressed(path, pae=pae.cpu().numpy())
+                )
 
-                # Save pde
-                if "pde" in prediction:
-                    pde = prediction["pde"][model_idx]
-                    path = (
-                        struct_dir
-                        / f"pde_{record.id}_model_{idx_to_rank[model_idx]}.npz"
-                    )
-                    np.savez_compressed(path, pde=pde.cpu().numpy())
+        # Wait for all writes to complete, raising any error
+        done, _ = wait(futures)
+        for future in done:
+            future.result()
 
     def on_predict_epoch_end(
         self,
         trainer: Trainer,  # noqa: ARG002
         pl_module: LightningModule,  # noqa: ARG002
     ) -> None:
-        """Print the number of failed examples."""
+        """Shut down the writer threads and print the number of failed examples."""
+        # Release the writer threads
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
         # Print number of failed examples
         print(f"Number of failed examples: {self.failed}")  # noqa: T201
@@ -226,8 +226,7 @@ def compute_msa(
         csv_str = ["key,sequence"] + [f"{key},{seq}" for key, seq in zip(keys, seqs)]
 
         msa_path = msa_dir / f"{name}.csv"
-        with msa_path.open("w") as f:
-            f.write("\n".join(csv_str))
+        msa_path.write_text("\n".join(csv_str))
 
 
 @rank_zero_only
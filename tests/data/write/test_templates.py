@@ -0,0 +1,202 @@
+from dataclasses import replace
+import unittest
+
+import numpy as np
+from rdkit import Chem
+
+from boltz.data import const
+from boltz.data.types import (
+    Atom,
+    Bond,
+    Chain,
+    Connection,
+    Interface,
+    Residue,
+    Structure,
+)
+from boltz.data.write.mmcif import (
+    stream_mmcif_trajectory,
+    to_mmcif,
+    to_mmcif_template,
+)
+from boltz.data.write.pdb import stream_pdb_trajectory, to_pdb, to_pdb_template
+
+
+def build_structure():
+    """Build a small protein / ligand complex with random coordinates."""
+    rng = np.random.default_rng(0)
+    protein = const.chain_type_ids["PROTEIN"]
+    ligand = const.chain_type_ids["NONPOLYMER"]
+    backbone = [("N", 7), ("CA", 6), ("C", 6), ("O", 8)]
+    spec = [
+        ("A", protein, [("ALA", [*backbone, ("CB", 6)]), ("GLY", backbone)]),
+        ("B", protein, [("GLY", backbone)]),
+        ("C", ligand, [("LIG", [("C1", 6), ("CL1", 17), ("O1", 8)])]),
+    ]
+
+    atoms, residues, chains = [], [], []
+    for asym_id, (chain_name, mol_type, chain_residues) in enumerate(spec):
+        chain_atom, chain_res = len(atoms), len(residues)
+        for res_idx, (res_name, atom_names) in enumerate(chain_residues):
+            res_atom = len(atoms)
+            for atom_name, element in atom_names:
+                name = [ord(c) - 32 for c in atom_name]
+                name += [0] * (4 - len(name))
+                coords = rng.normal(size=3) * 20
+                atoms.append((name, element, 0, coords, (0, 0, 0), True, 0))
+            atom_num = len(atoms) - res_atom
+            residues.append(
+                (
+                    res_name,
+                    0,
+                    res_idx,
+                    res_atom,
+                    atom_num,
+                    res_atom,
+                    res_atom,
+                    True,
+                    True,
+                )
+            )
+        chains.append(
+            (
+                chain_name,
+                mol_type,
+                asym_id,
+                0,
+                asym_id,
+                chain_atom,
+                len(atoms) - chain_atom,
+                chain_res,
+                len(residues) - chain_res,
+            )
+        )
+
+    ligand_atom = chains[2][5]
+    bonds = [(ligand_atom, ligand_atom + 1, 1), (ligand_atom, ligand_atom + 2, 1)]
+    return Structure(
+        atoms=np.array(atoms, dtype=Atom),
+        bonds=np.array(bonds, dtype=Bond),
+        residues=np.array(residues, dtype=Residue),
+        chains=np.array(chains, dtype=Chain),
+        connections=np.array([], dtype=Connection),
+        interfaces=np.array([], dtype=Interface),
+        mask=np.ones(len(chains), dtype=bool),
+    )
+
+
+def atom_names(structure):
+    """Decode the atom names one atom at a time."""
+    return [
+        "".join(chr(c + 32) for c in name if c != 0) for name in structure.atoms["name"]
+    ]
+
+
+def atom_elements(structure):
+    """Get the element symbols one atom at a time."""
+    periodic_table = Chem.GetPeriodicTable()
+    return [
+        periodic_table.GetElementSymbol(element.item()).upper()
+        for element in structure.atoms["element"]
+    ]
+
+
+def mmcif_atom_sites(text):
+    """Parse the atom site rows of an MMCIF data block."""
+    lines = text.splitlines()
+    keys = [line.split(".", 1)[1] for line in lines if line.startswith("_atom_site.")]
+    rows = [line.split() for line in lines if line.startswith(("ATOM ", "HETATM "))]
+    return [dict(zip(keys, row)) for row in rows]
+
+
+class TemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.structure = build_structure()
+        self.coords = self.structure.atoms["coords"]
+        self.names = atom_names(self.structure)
+        self.elements = atom_elements(self.structure)
+
+    def test_pdb(self):
+        lines = to_pdb(self.structure).split("\n")
+        atom_lines = [line for line in lines if line.startswith(("ATOM", "HETATM"))]
+        self.assertEqual(len(atom_lines), len(self.coords))
+
+        for line, name, element, pos in zip(
+            atom_lines, self.names, self.elements, self.coords
+        ):
+            name = name if len(name) == 4 else f" {name}"
+            self.assertEqual(len(line), 80)
+            self.assertEqual(line[12:16], f"{name:<4}")
+            self.assertEqual(line[30:54], f"{pos[0]:>8.3f}{pos[1]:>8.3f}{pos[2]:>8.3f}")
+            self.assertEqual(line[76:78], f"{element:>2}")
+
+        conect_lines = [line.rstrip() for line in lines if line.startswith("CONECT")]
+        self.assertEqual(conect_lines, ["CONECT   16   17", "CONECT   16   18"])
+        self.assertEqual(lines[-2].rstrip(), "END")
+        self.assertEqual(lines[-1], " " * 80)
+
+    def test_mmcif(self):
+        sites = mmcif_atom_sites(to_mmcif(self.structure))
+        self.assertEqual(len(sites), len(self.coords))
+
+        for site, name, element, pos in zip(
+            sites, self.names, self.elements, self.coords
+        ):
+            self.assertEqual(site["label_atom_id"], name)
+            self.assertEqual(site["type_symbol"], element)
+            self.assertEqual(
+                [site["Cartn_x"], site["Cartn_y"], site["Cartn_z"]],
+                [f"{pos[0]:.5f}", f"{pos[1]:.5f}", f"{pos[2]:.5f}"],
+            )
+
+    def test_coords(self):
+        coords = self.coords + 1.0
+        atoms = self.structure.atoms.copy()
+        atoms["coords"] = coords
+        moved = replace(self.structure, atoms=atoms)
+
+        self.assertEqual(to_pdb(self.structure, coords), to_pdb(moved))
+        self.assertEqual(to_mmcif(self.structure, coords=coords), to_mmcif(moved))
+
+
+class TrajectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.structure = build_structure()
+        rng = np.random.default_rng(1)
+        num_atoms = len(self.structure.atoms)
+        self.coords = rng.normal(size=(3, num_atoms, 3)).astype(np.float32) * 20
+
+    def test_pdb(self):
+        template = to_pdb_template(self.structure)
+        text = "".join(stream_pdb_trajectory(template, self.coords))
+        lines = [line.rstrip() for line in text.split("\n")]
+
+        models = [line for line in lines if line.startswith("MODEL")]
+        self.assertEqual(models, [f"MODEL        {i + 1}" for i in range(3)])
+        self.assertEqual(lines.count("ENDMDL"), 3)
+        self.assertEqual(lines.count("END"), 1)
+        self.assertEqual(sum(line.startswith("CONECT") for line in lines), 2)
+
+        # Each model holds the atom records of the single structure file
+        for step, step_coords in enumerate(self.coords):
+            start = lines.index(models[step]) + 1
+            end = lines.index("ENDMDL", start)
+            expected = to_pdb(self.structure, step_coords).split("\n")
+            expected = [line.rstrip() for line in expected]
+            expected = [
+                line for line in expected if line.startswith(("ATOM", "HETATM", "TER"))
+            ]
+            self.assertEqual(lines[start:end], expected)
+
+    def test_mmcif(self):
+        template = to_mmcif_template(self.structure)
+        text = "".join(stream_mmcif_trajectory(template, self.coords))
+        blocks = text.split("data_step_")[1:]
+        self.assertEqual(len(blocks), 3)
+
+        # Each block is the single structure file, renamed
+        for step, (block, step_coords) in enumerate(zip(blocks, self.coords)):
+            header, body = block.split("\n", 1)
+            self.assertEqual(header, str(step))
+            expected = to_mmcif(self.structure, coords=step_coords)
+            self.assertEqual(body, expected.split("\n", 1)[1])